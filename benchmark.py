@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark del convertitore EML to PDF
+Misura i tempi di generazione del PDF al crescere del numero di allegati
+e il throughput dell'estrazione dei soli metadati (--extract-only)
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from v3 import (create_pdf_with_attachments, format_file_size, extract_metadata_ndjson, parse_eml_file,
+                get_extract_pool, iter_metadata_records)
+
+# Obiettivo di throughput dell'estrazione metadati, in messaggi al secondo per core
+# (messaggi di ~200 kB con corpo HTML e 3 allegati)
+EXTRACT_TARGET_PER_CORE = 1000
+
+CONTENT_TYPES = ['application/pdf', 'application/pkcs7-mime', 'image/jpeg', 'text/xml']
+
+def make_email_data(n_attachments):
+    """Crea dati email sintetici con n allegati (alcuni con nomi molto lunghi)"""
+    attachments = []
+    for i in range(n_attachments):
+        size = 1024 * (i % 500 + 1)
+        filename = f"notifica_{i:05d}.pdf"
+        if i % 10 == 0:
+            filename = f"documento_con_un_nome_file_estremamente_lungo_{'x' * 80}_{i:05d}.pdf.p7m"
+        attachments.append({
+            'filename': filename,
+            'size': format_file_size(size),
+            'size_bytes': size,
+            'content_type': CONTENT_TYPES[i % len(CONTENT_TYPES)]
+        })
+
+    return {
+        'subject': f"Benchmark con {n_attachments} allegati",
+        'sender': 'benchmark@example.com',
+        'recipient': 'destinatario@example.com',
+        'date': 'Mon, 1 Jan 2024 00:00:00 +0000',
+        'body': "Messaggio di prova\n" * 20,
+        'attachments': attachments
+    }
+
+def bench_attachments(sizes=(10, 1000, 10000)):
+    """Stampa il tempo di creazione del PDF per ogni numero di allegati"""
+    print("Allegati | Tempo (s) | Dimensione PDF")
+    for n in sizes:
+        email_data = make_email_data(n)
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, 'bench.pdf')
+            start = time.perf_counter()
+            create_pdf_with_attachments(email_data, pdf_path)
+            elapsed = time.perf_counter() - start
+            pdf_size = format_file_size(os.path.getsize(pdf_path))
+        print(f"{n:>8} | {elapsed:>9.2f} | {pdf_size}")
+
+def make_eml_bytes(i, n_attachments=3, attachment_size=48 * 1024):
+    """Crea un messaggio EML sintetico con corpo HTML e allegati binari"""
+    msg = MIMEMultipart()
+    msg['Subject'] = f"Notifica {i}"
+    msg['From'] = '"Mittente" <mittente@pec.example.com>'
+    msg['To'] = 'destinatario@example.com'
+    msg['Date'] = 'Mon, 1 Jan 2024 00:00:00 +0000'
+    msg['Message-ID'] = f"<{i}@example.com>"
+    msg.attach(MIMEText("<html><body>" + "<p>Testo del messaggio</p>" * 200 + "</body></html>", 'html'))
+    for j in range(n_attachments):
+        attachment = MIMEApplication(os.urandom(attachment_size), 'pdf')
+        attachment.add_header('Content-Disposition', 'attachment', filename=f"allegato_{j}.pdf")
+        msg.attach(attachment)
+    return msg.as_bytes()
+
+def bench_extract(n_messages=2000):
+    """Stampa il throughput dell'estrazione metadati rispetto al parsing completo"""
+    with tempfile.TemporaryDirectory() as tmp:
+        eml_paths = []
+        for i in range(n_messages):
+            path = os.path.join(tmp, f"{i:05d}.eml")
+            with open(path, 'wb') as f:
+                f.write(make_eml_bytes(i))
+            eml_paths.append(path)
+        
+        start = time.perf_counter()
+        for path in eml_paths:
+            parse_eml_file(path)
+        full_rate = n_messages / (time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        extract_metadata_ndjson(eml_paths, io.StringIO(), workers=1)
+        extract_rate = n_messages / (time.perf_counter() - start)
+        
+        workers = os.cpu_count() or 1
+        start = time.perf_counter()
+        extract_metadata_ndjson(eml_paths, io.StringIO(), workers=workers)
+        pool_rate = n_messages / (time.perf_counter() - start)
+    
+    print(f"Messaggi: {n_messages}")
+    print(f"parse_eml_file:           {full_rate:>8.0f} msg/s (1 core)")
+    print(f"--extract-only:           {extract_rate:>8.0f} msg/s (1 core, obiettivo {EXTRACT_TARGET_PER_CORE})")
+    print(f"--extract-only pool:      {pool_rate:>8.0f} msg/s ({workers} processi)")
+
+def bench_extract_pool(batch_sizes=(1, 2, 4, 8, 16, 32, 64)):
+    """Stampa il tempo di una richiesta di estrazione al crescere dei file inviati
+    
+    Confronta l'estrazione nel processo corrente, un pool creato per la
+    richiesta e il pool condiviso di get_extract_pool() già avviato: serve a
+    scegliere EXTRACT_POOL_MIN_FILES di server.py.
+    """
+    # Almeno 2 processi, altrimenti iter_metadata_records non usa il pool
+    workers = max(2, os.cpu_count() or 1)
+    pool = get_extract_pool()
+    with tempfile.TemporaryDirectory() as tmp:
+        eml_paths = []
+        for i in range(max(batch_sizes)):
+            path = os.path.join(tmp, f"{i:05d}.eml")
+            with open(path, 'wb') as f:
+                f.write(make_eml_bytes(i))
+            eml_paths.append(path)
+        
+        # Avvia i processi del pool condiviso prima di misurare
+        list(iter_metadata_records(eml_paths[:workers], workers=workers, pool=pool))
+        
+        print(f"CPU: {os.cpu_count()}")
+        print("File | Processo (ms) | Pool per richiesta (ms) | Pool condiviso (ms)")
+        for n in batch_sizes:
+            timings = []
+            for options in ({'workers': 1}, {'workers': workers}, {'workers': workers, 'pool': pool}):
+                # Il migliore di 3 tentativi, per ridurre il rumore sulle richieste piccole
+                best = None
+                for _ in range(3):
+                    start = time.perf_counter()
+                    list(iter_metadata_records(eml_paths[:n], **options))
+                    elapsed = (time.perf_counter() - start) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best)
+            print(f"{n:>4} | {timings[0]:>13.1f} | {timings[1]:>23.1f} | {timings[2]:>19.1f}")
+
+if __name__ == "__main__":
+    # Uso: python benchmark.py [attachments [numero allegati ...] | extract [numero messaggi]
+    #                           | pool [numero file ...]]
+    mode = sys.argv[1] if len(sys.argv) > 1 else None
+    numbers = tuple(int(arg) for arg in sys.argv[2:])
+    
+    if mode in (None, 'attachments'):
+        bench_attachments(numbers or (10, 1000, 10000))
+    if mode in (None, 'extract'):
+        bench_extract(*numbers[:1])
+    if mode in (None, 'pool'):
+        bench_extract_pool(numbers or (1, 2, 4, 8, 16, 32, 64))
@@ -6,8 +6,13 @@ Struttura directory rispettosa dei file esistenti
 Avvio automatico su interfaccia di rete locale con browser
 """
 
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory
+import functools
+import hashlib
+import json
+import multiprocessing
 import os
+import re
 import tempfile
 import uuid
 import socket
@@ -15,10 +20,12 @@ import webbrowser
 import threading
 import time
 from datetime import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NEED_DATA
 
 # Importa le funzioni dal tuo script v3.py (nella stessa directory)
 try:
-    from v3 import parse_eml_file, create_pdf_with_attachments, format_file_size
+    from v3 import parse_eml_file, create_pdf_with_attachments, format_file_size, iter_metadata_records, looks_like_eml, get_extract_pool
     print("✅ Modulo v3.py importato correttamente!")
 except ImportError as e:
     print(f"❌ ERRORE: Impossibile importare v3.py - {e}")
@@ -36,6 +43,8 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    # Rende leggibile da fetch() cross-origin l'hash dell'upload
+    response.headers.add('Access-Control-Expose-Headers', 'X-Content-SHA256')
     return response
 
 # Directory paths
@@ -48,6 +57,236 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 HTML_FILE = os.path.join(CURRENT_DIR, 'index.html')
 STYLES_DIR = os.path.join(CURRENT_DIR, 'styles')
 
+# Canale di avanzamento (Server-Sent Events) delle conversioni
+PROGRESS_JOB_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+PROGRESS_HEARTBEAT_SECONDS = 1      # Intervallo dei keepalive SSE
+PROGRESS_GRACE_SECONDS = 5          # Tempo concesso a EventSource per riconnettersi
+PROGRESS_ATTACH_SECONDS = 5         # Attesa massima della conversione che usa il job
+PROGRESS_JOB_TTL_SECONDS = 600      # Dopo questo tempo un job finito e non letto viene scartato
+MAX_PROGRESS_STREAMS_PER_CLIENT = 4 # Canali SSE contemporanei per indirizzo IP
+
+# Fasi dopo le quali il canale SSE si chiude ('expired': nessuna conversione collegata)
+PROGRESS_TERMINAL_STAGES = ('done', 'error', 'cancelled', 'expired')
+
+class ConversionCancelled(Exception):
+    """Conversione interrotta perché il client l'ha abbandonata"""
+
+class ConversionProgress:
+    """Stato di una conversione condiviso tra la richiesta e il canale SSE"""
+    
+    def __init__(self):
+        self.events = []
+        self.created = time.time()
+        self.finished = False
+        self.attached = False
+        self.cancelled = threading.Event()
+        self.subscribers = 0
+        self.last_seen = None
+        self.condition = threading.Condition()
+    
+    def publish(self, stage, **info):
+        """Aggiunge un evento e sveglia i client in ascolto"""
+        with self.condition:
+            self.events.append(dict(info, stage=stage))
+            if stage in PROGRESS_TERMINAL_STAGES:
+                self.finished = True
+            self.condition.notify_all()
+    
+    def wait_events(self, start, timeout):
+        """Restituisce gli eventi successivi a start, attendendo al massimo timeout secondi"""
+        with self.condition:
+            if len(self.events) <= start and not self.finished:
+                self.condition.wait(timeout)
+            self.last_seen = time.time()
+            return self.events[start:], self.finished
+    
+    def abandoned(self):
+        """True se il client ha annullato o ha chiuso il canale SSE senza riconnettersi"""
+        if self.cancelled.is_set():
+            return True
+        with self.condition:
+            return (self.subscribers == 0 and self.last_seen is not None
+                    and time.time() - self.last_seen > PROGRESS_GRACE_SECONDS)
+    
+    def hook(self, stage, **info):
+        """Callback per parse_eml_file e create_pdf_with_attachments"""
+        if self.abandoned():
+            raise ConversionCancelled()
+        self.publish(stage, **info)
+
+PROGRESS_JOBS = {}
+PROGRESS_STREAMS = {}
+PROGRESS_LOCK = threading.Lock()
+
+def get_progress_job(job_id):
+    """Restituisce (creandolo se serve) lo stato di avanzamento del job"""
+    with PROGRESS_LOCK:
+        # Scarta i job senza client collegati che nessuna conversione sta usando:
+        # quelli finiti e mai letti fino alla fine e quelli a cui nessuna
+        # conversione si è collegata (es. annullati prima dell'upload).
+        # Una conversione in corso rimuove il suo job da sé, anche oltre il TTL.
+        now = time.time()
+        for stale_id in [k for k, job in PROGRESS_JOBS.items()
+                         if not job.subscribers
+                         and ((job.finished and now - job.created > PROGRESS_JOB_TTL_SECONDS)
+                              or (not job.attached and now - job.created > PROGRESS_ATTACH_SECONDS))]:
+            del PROGRESS_JOBS[stale_id]
+        
+        if job_id not in PROGRESS_JOBS:
+            PROGRESS_JOBS[job_id] = ConversionProgress()
+        return PROGRESS_JOBS[job_id]
+
+def release_progress_job(job_id, job):
+    """Rimuove il job dal registro se nessun client SSE lo sta ancora leggendo"""
+    with PROGRESS_LOCK:
+        with job.condition:
+            if PROGRESS_JOBS.get(job_id) is job and not job.subscribers:
+                del PROGRESS_JOBS[job_id]
+
+# Ingestione in streaming degli upload .eml
+UPLOAD_CHUNK_SIZE = 64 * 1024       # Blocchi letti dal body della richiesta
+UPLOAD_SNIFF_SIZE = 8 * 1024        # Byte controllati prima di scrivere su disco
+UPLOAD_FIELD_MAX_SIZE = 4 * 1024    # Dimensione massima degli altri campi del form
+MAX_UPLOADS_PER_CLIENT = 2          # Richieste contemporanee per indirizzo IP
+EXTRACT_POOL_MIN_FILES = 8          # File oltre i quali /api/extract-metadata usa il pool di processi (vedi benchmark.py pool)
+
+class UploadRejected(Exception):
+    """Upload rifiutato durante la lettura del body"""
+    
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def ingest_eml_upload(dest_path, on_field=None):
+    """Legge il body multipart a blocchi e salva il campo 'file' in dest_path
+    
+    Controlla estensione, dimensione e blocco header RFC 822 prima di scrivere
+    su disco e calcola lo SHA-256 durante la lettura. on_field(nome, valore)
+    viene chiamato appena arriva ciascuno degli altri campi del form.
+    Restituisce (nome file, sha256 esadecimale, dimensione, altri campi del form).
+    """
+    max_size = app.config['MAX_CONTENT_LENGTH']
+    if request.content_length is not None and request.content_length > max_size:
+        raise UploadRejected(f'File troppo grande (massimo {format_file_size(max_size)})', 413)
+    
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        raise UploadRejected('Richiesta multipart/form-data attesa')
+    
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    fields = {}
+    field_name = None
+    field_value = b''
+    filename = None
+    in_file = False
+    head = b''
+    out = None
+    sha256 = hashlib.sha256()
+    size = 0
+    
+    try:
+        finished = False
+        while not finished:
+            chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            
+            event = decoder.next_event()
+            while event is not NEED_DATA:
+                if isinstance(event, Epilogue):
+                    finished = True
+                    break
+                
+                if isinstance(event, File):
+                    field_name = None
+                    in_file = event.name == 'file' and filename is None
+                    if in_file:
+                        filename = event.filename
+                        if filename == '':
+                            raise UploadRejected('Nessun file selezionato')
+                        if not filename.lower().endswith('.eml'):
+                            raise UploadRejected('Il file deve essere un .eml')
+                elif isinstance(event, Field):
+                    in_file = False
+                    field_name = event.name
+                    field_value = b''
+                elif isinstance(event, Data) and in_file:
+                    size += len(event.data)
+                    if size > max_size:
+                        raise UploadRejected(f'File troppo grande (massimo {format_file_size(max_size)})', 413)
+                    sha256.update(event.data)
+                    
+                    if out is not None:
+                        out.write(event.data)
+                    else:
+                        # Accumula l'inizio del file e lo controlla prima di aprire il file su disco
+                        head += event.data
+                        if len(head) >= UPLOAD_SNIFF_SIZE or not event.more_data:
+                            if not looks_like_eml(head, complete=not event.more_data):
+                                raise UploadRejected('Il file non è un messaggio email valido (header RFC 822 mancanti)')
+                            out = open(dest_path, 'wb')
+                            out.write(head)
+                            head = b''
+                elif isinstance(event, Data) and field_name:
+                    field_value += event.data
+                    if len(field_value) > UPLOAD_FIELD_MAX_SIZE:
+                        raise UploadRejected(f'Campo {field_name} troppo grande', 413)
+                    if not event.more_data:
+                        fields[field_name] = field_value.decode('utf-8', errors='replace')
+                        if on_field:
+                            on_field(field_name, fields[field_name])
+                        field_name = None
+                
+                event = decoder.next_event()
+            
+            if not chunk:
+                break
+    except RequestEntityTooLarge:
+        # Limite di werkzeug sul body senza Content-Length
+        raise UploadRejected(f'File troppo grande (massimo {format_file_size(max_size)})', 413)
+    except ValueError as e:
+        raise UploadRejected(f'Richiesta multipart non valida: {e}')
+    finally:
+        if out is not None:
+            out.close()
+    
+    if filename is None:
+        raise UploadRejected('Nessun file fornito')
+    if out is None:
+        raise UploadRejected('Il file è vuoto o incompleto')
+    
+    return filename, sha256.hexdigest(), size, fields
+
+CLIENT_UPLOADS = {}
+CLIENT_UPLOADS_LOCK = threading.Lock()
+
+def acquire_client_slot(client):
+    """Occupa una delle MAX_UPLOADS_PER_CLIENT richieste del client; False se sono tutte in corso"""
+    with CLIENT_UPLOADS_LOCK:
+        if CLIENT_UPLOADS.get(client, 0) >= MAX_UPLOADS_PER_CLIENT:
+            return False
+        CLIENT_UPLOADS[client] = CLIENT_UPLOADS.get(client, 0) + 1
+        return True
+
+def release_client_slot(client):
+    """Libera la richiesta occupata con acquire_client_slot"""
+    with CLIENT_UPLOADS_LOCK:
+        CLIENT_UPLOADS[client] -= 1
+        if not CLIENT_UPLOADS[client]:
+            del CLIENT_UPLOADS[client]
+
+def limit_per_client(view):
+    """Limita a MAX_UPLOADS_PER_CLIENT le richieste contemporanee dello stesso client"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        client = request.remote_addr
+        if not acquire_client_slot(client):
+            return jsonify({'error': 'Troppe richieste in corso, attendi il completamento'}), 429
+        try:
+            return view(*args, **kwargs)
+        finally:
+            release_client_slot(client)
+    return wrapper
+
 def get_local_ip():
     """Ottiene l'indirizzo IP locale della macchina"""
     try:
@@ -100,35 +339,33 @@ def styles(filename):
         }), 404
 
 @app.route('/api/parse-eml', methods=['POST'])
+@limit_per_client
 def parse_eml():
     """API per analizzare un file EML"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'Nessun file fornito'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'Nessun file selezionato'}), 400
-        
-        if not file.filename.lower().endswith('.eml'):
-            return jsonify({'error': 'Il file deve essere un .eml'}), 400
-        
-        # Salva il file temporaneamente
+        # Salva il file temporaneamente leggendolo a blocchi
         temp_id = str(uuid.uuid4())
         temp_path = os.path.join(UPLOAD_FOLDER, f"{temp_id}.eml")
-        file.save(temp_path)
         
         try:
+            filename, sha256, size, _ = ingest_eml_upload(temp_path)
+            
             # Usa la funzione del tuo script v3.py
             print(f"📧 Analizzando: {temp_path}")
             email_data = parse_eml_file(temp_path)
             print(f"✅ Email analizzata: {email_data['subject']}")
             
-            # Aggiungi l'ID temporaneo per riferimento futuro
+            # Aggiungi l'ID temporaneo per riferimento futuro e l'hash per la deduplica
             email_data['temp_id'] = temp_id
+            email_data['sha256'] = sha256
             
-            return jsonify(email_data)
+            response = jsonify(email_data)
+            response.headers['X-Content-SHA256'] = sha256
+            return response
             
+        except UploadRejected as e:
+            print(f"⛔ Upload rifiutato: {e}")
+            return jsonify({'error': str(e)}), e.status
         except Exception as e:
             print(f"❌ Errore nell'analisi: {e}")
             return jsonify({'error': f'Errore nell\'analisi del file: {str(e)}'}), 500
@@ -145,44 +382,74 @@ def parse_eml():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/convert-to-pdf', methods=['POST'])
+@limit_per_client
 def convert_to_pdf():
     """API per convertire EML in PDF"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'Nessun file fornito'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'Nessun file selezionato'}), 400
-        
-        # Salva il file temporaneamente
+        # Salva il file temporaneamente leggendolo a blocchi
         temp_id = str(uuid.uuid4())
         eml_path = os.path.join(UPLOAD_FOLDER, f"{temp_id}.eml")
         pdf_path = os.path.join(UPLOAD_FOLDER, f"{temp_id}.pdf")
+        job_id = ''
+        job = None
         
-        file.save(eml_path)
+        def attach_job(name, value):
+            """Collega il job appena arriva il campo job_id, prima del file"""
+            nonlocal job_id, job
+            if name == 'job_id' and job is None and PROGRESS_JOB_ID_RE.match(value):
+                job_id = value
+                job = get_progress_job(job_id)
+                job.attached = True
         
         try:
+            filename, sha256, size, fields = ingest_eml_upload(eml_path, on_field=attach_job)
+            
+            # Canale di avanzamento opzionale (vedi /api/progress/<job_id>)
+            if fields.get('job_id') and job is None:
+                return jsonify({'error': 'job_id non valido'}), 400
+            progress = job.hook if job else None
+            
             print(f"📧 Convertendo: {eml_path}")
+            if progress:
+                progress('upload-received', size=size)
             
             # Usa le funzioni del tuo script v3.py
-            email_data = parse_eml_file(eml_path)
-            create_pdf_with_attachments(email_data, pdf_path)
+            email_data = parse_eml_file(eml_path, progress=progress)
+            create_pdf_with_attachments(email_data, pdf_path, progress=progress)
             
             print(f"✅ PDF creato: {pdf_path}")
+            if job:
+                job.publish('done')
             
             # Invia il PDF come download
-            return send_file(
+            response = send_file(
                 pdf_path,
                 as_attachment=True,
-                download_name=file.filename.replace('.eml', '.pdf'),
+                download_name=filename.replace('.eml', '.pdf'),
                 mimetype='application/pdf'
             )
+            response.headers['X-Content-SHA256'] = sha256
+            return response
             
+        except UploadRejected as e:
+            print(f"⛔ Upload rifiutato: {e}")
+            if job:
+                job.publish('error', error=str(e))
+            return jsonify({'error': str(e)}), e.status
+        except ConversionCancelled:
+            print(f"🛑 Conversione annullata dal client: {eml_path}")
+            job.publish('cancelled')
+            return jsonify({'error': 'Conversione annullata'}), 499
         except Exception as e:
             print(f"❌ Errore nella conversione: {e}")
+            if job:
+                job.publish('error', error=str(e))
             return jsonify({'error': f'Errore nella conversione: {str(e)}'}), 500
         finally:
+            # Senza client SSE in ascolto nessuno rimuoverà il job
+            if job:
+                release_progress_job(job_id, job)
+            
             # Pulisci i file temporanei
             for temp_file in [eml_path, pdf_path]:
                 try:
@@ -195,6 +462,127 @@ def convert_to_pdf():
         print(f"❌ Errore generale: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/progress/<job_id>')
+def conversion_progress(job_id):
+    """Canale Server-Sent Events con l'avanzamento di una conversione"""
+    if not PROGRESS_JOB_ID_RE.match(job_id):
+        return jsonify({'error': 'job_id non valido'}), 400
+    
+    client = request.remote_addr
+    with PROGRESS_LOCK:
+        if PROGRESS_STREAMS.get(client, 0) >= MAX_PROGRESS_STREAMS_PER_CLIENT:
+            return jsonify({'error': 'Troppi canali di avanzamento aperti'}), 429
+        PROGRESS_STREAMS[client] = PROGRESS_STREAMS.get(client, 0) + 1
+    
+    job = get_progress_job(job_id)
+    with job.condition:
+        job.subscribers += 1
+    
+    def generate():
+        sent = 0
+        finished = False
+        yield f"retry: {PROGRESS_GRACE_SECONDS * 1000 // 2}\n\n"
+        while not finished:
+            events, finished = job.wait_events(sent, PROGRESS_HEARTBEAT_SECONDS)
+            for event in events:
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            sent += len(events)
+            if not events and not finished:
+                # Nessuna conversione collegata (es. riconnessione dopo 'done'):
+                # l'evento finale dice al client di chiudere il canale
+                if not job.attached and time.time() - job.created > PROGRESS_ATTACH_SECONDS:
+                    yield f"data: {json.dumps({'stage': 'expired'})}\n\n"
+                    break
+                # Il keepalive fa emergere subito la disconnessione del client
+                yield ": keepalive\n\n"
+    
+    def close_stream():
+        """Chiamata alla chiusura della risposta, anche se il client si disconnette"""
+        with job.condition:
+            job.subscribers -= 1
+            job.last_seen = time.time()
+        if job.finished or not job.attached:
+            release_progress_job(job_id, job)
+        with PROGRESS_LOCK:
+            PROGRESS_STREAMS[client] -= 1
+            if not PROGRESS_STREAMS[client]:
+                del PROGRESS_STREAMS[client]
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(close_stream)
+    return response
+
+@app.route('/api/progress/<job_id>/cancel', methods=['POST'])
+def cancel_conversion(job_id):
+    """Annulla una conversione in corso: il worker si ferma alla pagina successiva"""
+    if not PROGRESS_JOB_ID_RE.match(job_id):
+        return jsonify({'error': 'job_id non valido'}), 400
+    
+    # Solo lookup: un id sconosciuto non deve creare un job
+    with PROGRESS_LOCK:
+        job = PROGRESS_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Conversione non trovata'}), 404
+    
+    job.cancelled.set()
+    return jsonify({'status': 'cancelled', 'job_id': job_id})
+
+@app.route('/api/extract-metadata', methods=['POST'])
+def extract_metadata():
+    """API per estrarre solo i metadati (header e allegati) come NDJSON, senza PDF"""
+    # Come limit_per_client, ma il posto resta occupato finché lo stream NDJSON
+    # non viene chiuso: i record vengono prodotti dopo il return della view
+    client = request.remote_addr
+    if not acquire_client_slot(client):
+        return jsonify({'error': 'Troppe richieste in corso, attendi il completamento'}), 429
+    
+    response = None
+    try:
+        files = [f for f in request.files.getlist('file') if f.filename]
+        if not files:
+            return jsonify({'error': 'Nessun file fornito'}), 400
+        
+        # Salva prima tutti i file: gli upload non sono più leggibili durante lo streaming
+        uploads = []
+        for file in files:
+            temp_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4()}.eml")
+            file.save(temp_path)
+            uploads.append((file.filename, temp_path))
+        
+        # Con molti file e più CPU l'estrazione usa il pool di processi condiviso
+        # di v3.py, avviato alla prima richiesta e riusato dalle successive
+        pool = None
+        if len(uploads) >= EXTRACT_POOL_MIN_FILES and (os.cpu_count() or 1) > 1:
+            pool = get_extract_pool()
+        
+        def generate():
+            try:
+                yield from (record + "\n" for record in iter_metadata_records(
+                    [temp_path for _, temp_path in uploads],
+                    workers=None if pool else 1,
+                    names=[filename for filename, _ in uploads],
+                    pool=pool
+                ))
+            finally:
+                # Pulisci i file temporanei anche se il client interrompe lo stream
+                for _, temp_path in uploads:
+                    try:
+                        if os.path.exists(temp_path):
+                            os.remove(temp_path)
+                    except:
+                        pass
+        
+        response = Response(generate(), mimetype='application/x-ndjson')
+        response.call_on_close(lambda: release_client_slot(client))
+        return response
+    finally:
+        # Senza stream nessuno chiamerà call_on_close
+        if response is None:
+            release_client_slot(client)
+
 @app.route('/health')
 def health():
     """Endpoint per verificare lo stato del server"""
@@ -254,6 +642,9 @@ def debug_structure():
     return jsonify(structure)
 
 if __name__ == '__main__':
+    # Necessario per il pool di processi nell'eseguibile creato con PyInstaller
+    multiprocessing.freeze_support()
+    
     print("🚀 Avviando il server Flask con interfaccia di rete...")
     print("📧 Convertitore EML to PDF con apertura browser automatica!")
     print(f"📁 Directory corrente: {CURRENT_DIR}")
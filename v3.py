@@ -4,20 +4,53 @@ Script per convertire file EML in PDF aggiungendo automaticamente
 la lista degli allegati alla fine del documento
 """
 
+import atexit
 import email
+import json
+import multiprocessing
 import os
+import sys
+import threading
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, LongTable, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.lib.units import cm
+from reportlab.pdfbase.pdfmetrics import stringWidth
 import html2text
 from datetime import datetime
 import re
 from email.header import decode_header
 from email.utils import parseaddr
+from email.parser import BytesHeaderParser
+
+# Oltre questa soglia la sezione allegati mostra il riepilogo per tipo
+# e raggruppa le righe per content type
+ATTACHMENT_SUMMARY_MIN = 20
+
+# Righe per ogni tabella della lista allegati: tabelle piccole evitano che
+# ReportLab ricalcoli il layout di migliaia di righe a ogni cambio pagina
+ATTACHMENT_TABLE_CHUNK = 200
+
+# Numero massimo di allegati elencati nel PDF (None = tutti); gli altri
+# vengono riassunti in una riga finale
+MAX_ATTACHMENT_ROWS = None
+
+# Valore di default di max_rows: usa MAX_ATTACHMENT_ROWS (None = tutti)
+DEFAULT_MAX_ROWS = object()
+
+# Cache delle larghezze dei caratteri per wrap_filename
+CHAR_WIDTHS = {}
+
+# Fine del blocco header (prima riga vuota) per --extract-only
+HEADER_END_RE = re.compile(rb'\r?\n\r?\n')
+
+# Riga di header RFC 822 (nome del campo seguito da ':') e caratteri di
+# controllo che non possono comparire negli header
+HEADER_FIELD_RE = re.compile(rb'^[!-9;-~]+[ \t]*:')
+HEADER_CONTROL_RE = re.compile(rb'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
 
 def decode_email_header(header_value):
     """Decodifica gli header email che potrebbero essere codificati"""
@@ -125,11 +158,8 @@ def format_sender_info(header_value, msg):
         else:
             return decoded_header
 
-def parse_eml_file(eml_path):
-    """Legge e analizza il file EML"""
-    with open(eml_path, 'rb') as f:
-        msg = email.message_from_bytes(f.read())
-    
+def parse_email_headers(msg):
+    """Estrae oggetto, mittente, destinatari e data dagli header del messaggio"""
     # Estrae le informazioni principali con gestione migliorata
     subject = decode_email_header(msg.get('Subject', 'Nessun oggetto'))
     
@@ -170,6 +200,56 @@ def parse_eml_file(eml_path):
     # Gestione della data
     date = decode_email_header(msg.get('Date', 'Data sconosciuta'))
     
+    return {
+        'subject': subject,
+        'sender': sender,
+        'recipient': recipient,
+        'date': date
+    }
+
+def get_attachment_filename(part):
+    """Restituisce il nome decodificato se la parte è un allegato (attachment o inline)"""
+    # Controlla sia attachment che inline
+    content_disposition = part.get('Content-Disposition', '')
+    if 'attachment' in content_disposition or 'inline' in content_disposition:
+        filename = part.get_filename()
+        if filename:
+            # Decodifica il nome del file
+            return decode_email_header(filename)
+    return None
+
+def extract_attachments(msg):
+    """Estrae la lista degli allegati (nome, dimensione, content type)"""
+    attachments = []
+    if msg.is_multipart():
+        for part in msg.walk():
+            filename = get_attachment_filename(part)
+            if filename:
+                # Calcola la dimensione dell'allegato
+                try:
+                    payload = part.get_payload(decode=True)
+                    size = len(payload) if payload else 0
+                except:
+                    size = 0
+                
+                size_str = format_file_size(size)
+                attachments.append({
+                    'filename': filename,
+                    'size': size_str,
+                    'size_bytes': size,
+                    'content_type': part.get_content_type() or 'application/octet-stream'
+                })
+    
+    return attachments
+
+def parse_eml_file(eml_path, progress=None):
+    """Legge e analizza il file EML
+    
+    progress, se indicato, viene chiamato come progress('parsed', attachments=N)
+    """
+    with open(eml_path, 'rb') as f:
+        msg = email.message_from_bytes(f.read())
+    
     # Estrae il corpo del messaggio
     body = ""
     if msg.is_multipart():
@@ -205,39 +285,247 @@ def parse_eml_file(eml_path):
         body = "Contenuto del messaggio non disponibile o vuoto"
     
     # Estrae gli allegati
-    attachments = []
-    if msg.is_multipart():
-        for part in msg.walk():
-            # Controlla sia attachment che inline
-            content_disposition = part.get('Content-Disposition', '')
-            if 'attachment' in content_disposition or 'inline' in content_disposition:
-                filename = part.get_filename()
-                if filename:
-                    # Decodifica il nome del file
-                    filename = decode_email_header(filename)
-                    
-                    # Calcola la dimensione dell'allegato
-                    try:
-                        payload = part.get_payload(decode=True)
-                        size = len(payload) if payload else 0
-                    except:
-                        size = 0
-                    
-                    size_str = format_file_size(size)
-                    attachments.append({
-                        'filename': filename,
-                        'size': size_str,
-                        'content_type': part.get_content_type() or 'application/octet-stream'
-                    })
+    attachments = extract_attachments(msg)
     
-    return {
-        'subject': subject,
-        'sender': sender,
-        'recipient': recipient,
-        'date': date,
-        'body': body,
-        'attachments': attachments
-    }
+    email_data = parse_email_headers(msg)
+    email_data['body'] = body
+    email_data['attachments'] = attachments
+    
+    if progress:
+        progress('parsed', attachments=len(attachments))
+    
+    return email_data
+
+def looks_like_eml(head, complete=False):
+    """Controlla che i primi byte di un file siano un blocco header RFC 822 valido
+    
+    head contiene solo l'inizio del file (complete=False) o il file intero:
+    nel primo caso si controllano solo le righe complete.
+    """
+    match = HEADER_END_RE.search(head)
+    if match:
+        block = head[:match.start()]
+    elif complete:
+        block = head
+    else:
+        block = head[:head.rfind(b'\n') + 1]
+    
+    lines = block.splitlines()
+    # Riga "From " iniziale dei file mbox esportati
+    if lines and lines[0].startswith(b'From '):
+        lines = lines[1:]
+    
+    headers = 0
+    for line in lines:
+        if HEADER_CONTROL_RE.search(line):
+            return False
+        if line[:1] in (b' ', b'\t'):
+            # Continuazione dell'header precedente
+            if not headers:
+                return False
+        elif HEADER_FIELD_RE.match(line):
+            headers += 1
+        else:
+            return False
+    return headers > 0
+
+def find_mime_delimiters(body, boundary):
+    """Trova i delimitatori di un multipart: lista di (inizio, inizio contenuto, chiusura)
+    
+    Come email.feedparser, "--boundary" è un delimitatore solo a inizio riga,
+    seguito eventualmente da "--" (chiusura) e solo da spazi fino a fine riga.
+    L'inizio comprende il fine riga che precede il delimitatore, che
+    appartiene al delimitatore e non alla parte precedente.
+    """
+    marker = b'--' + boundary
+    delimiters = []
+    pos = body.find(marker)
+    while pos != -1:
+        if pos == 0 or body[pos - 1] == 0x0a:
+            end = pos + len(marker)
+            closing = body.startswith(b'--', end)
+            if closing:
+                end += 2
+            line_end = body.find(b'\n', end)
+            if line_end == -1:
+                line_end = len(body)
+            if not body[end:line_end].strip(b' \t\r'):
+                start = pos
+                if start and body[start - 1] == 0x0a:
+                    start -= 1
+                    if start and body[start - 1] == 0x0d:
+                        start -= 1
+                delimiters.append((start, line_end + 1, closing))
+                if closing:
+                    break
+        pos = body.find(marker, pos + 1)
+    return delimiters
+
+def iter_mime_parts(data):
+    """Scorre la struttura MIME di un messaggio grezzo: produce (header, corpo grezzo)
+    
+    Cerca i boundary con bytes.find/split invece del parser riga per riga di
+    email.feedparser e analizza solo gli header, senza decodificare i payload.
+    L'ordine delle parti è lo stesso di Message.walk().
+    """
+    # Gli header terminano alla prima riga vuota
+    if data.startswith(b'\r\n') or data.startswith(b'\n'):
+        header_end, body_start = 0, data.index(b'\n') + 1
+    else:
+        match = HEADER_END_RE.search(data)
+        if match:
+            header_end, body_start = match.start(), match.end()
+        else:
+            header_end = body_start = len(data)
+    
+    headers = BytesHeaderParser().parsebytes(data[:header_end])
+    body = data[body_start:]
+    yield headers, body
+    
+    maintype = headers.get_content_maintype()
+    if maintype == 'multipart':
+        boundary = headers.get_boundary()
+        if not boundary:
+            return
+        
+        # Il testo prima del primo delimitatore è il preambolo; senza
+        # delimitatore di chiusura l'ultima parte arriva a fine messaggio
+        delimiters = find_mime_delimiters(body, boundary.encode('utf-8', errors='surrogateescape'))
+        for i, (_, content_start, closing) in enumerate(delimiters):
+            if closing:
+                break
+            end = delimiters[i + 1][0] if i + 1 < len(delimiters) else len(body)
+            # Delimitatori consecutivi: email.feedparser non crea la parte vuota
+            if end > content_start:
+                yield from iter_mime_parts(body[content_start:end])
+    elif headers.get_content_type() == 'message/rfc822':
+        # Messaggio incapsulato (es. postacert.eml nelle PEC)
+        encoding = str(headers.get('Content-Transfer-Encoding', '')).strip().lower()
+        if encoding in ('', '7bit', '8bit', 'binary'):
+            yield from iter_mime_parts(body)
+
+def estimate_payload_size(headers, body):
+    """Calcola la dimensione decodificata di un corpo grezzo senza decodificarlo"""
+    encoding = str(headers.get('Content-Transfer-Encoding', '')).strip().lower()
+    if encoding == 'base64':
+        # 4 caratteri base64 = 3 byte, meno il padding finale; conta gli spazi
+        # invece di rimuoverli per non copiare il corpo
+        chars = len(body) - sum(body.count(c) for c in (b'\r', b'\n', b' ', b'\t'))
+        padding = body[-8:].rstrip(b' \t\r\n')[-2:].count(b'=')
+        return max(chars * 3 // 4 - padding, 0)
+    if encoding == 'quoted-printable':
+        # Ogni =XX diventa 1 byte, gli a capo "soft" (= a fine riga) spariscono
+        soft_crlf = body.count(b'=\r\n')
+        soft_lf = body.count(b'=\n')
+        escapes = body.count(b'=') - soft_crlf - soft_lf
+        return max(len(body) - 2 * escapes - 3 * soft_crlf - 2 * soft_lf, 0)
+    return len(body)
+
+def extract_eml_metadata(eml_path):
+    """Estrae solo header e struttura delle parti, senza corpo né decodifica dei payload"""
+    with open(eml_path, 'rb') as f:
+        data = f.read()
+    
+    parts = iter_mime_parts(data)
+    msg, _ = next(parts)
+    
+    metadata = {'file': eml_path}
+    metadata.update(parse_email_headers(msg))
+    metadata['message_id'] = decode_email_header(msg.get('Message-ID', ''))
+    metadata['parts'] = 1
+    metadata['attachments'] = []
+    for headers, body in parts:
+        metadata['parts'] += 1
+        filename = get_attachment_filename(headers)
+        if filename:
+            size = estimate_payload_size(headers, body)
+            metadata['attachments'].append({
+                'filename': filename,
+                'size': format_file_size(size),
+                'size_bytes': size,
+                'content_type': headers.get_content_type() or 'application/octet-stream'
+            })
+    return metadata
+
+def extract_metadata_record(eml_path, name=None):
+    """Restituisce il record NDJSON (una riga JSON) con i metadati di un file EML
+    
+    name, se indicato, sostituisce il percorso nel campo 'file' del record
+    """
+    try:
+        record = extract_eml_metadata(eml_path)
+    except Exception as e:
+        record = {'file': eml_path, 'error': str(e)}
+    if name:
+        record['file'] = name
+    return json.dumps(record, ensure_ascii=False)
+
+def extract_metadata_job(job):
+    """Adatta extract_metadata_record a Pool.imap: job è (percorso, nome)"""
+    return extract_metadata_record(*job)
+
+# Pool di processi condiviso per l'estrazione metadati (vedi get_extract_pool)
+EXTRACT_POOL = None
+EXTRACT_POOL_LOCK = threading.Lock()
+
+def get_extract_pool():
+    """Restituisce il pool di processi condiviso per l'estrazione, creandolo al primo uso
+    
+    Il pool ha un processo per CPU, viene riusato da tutte le chiamate e
+    chiuso all'uscita del programma. Usa il contesto spawn: i processi non
+    ereditano thread, socket e lock del processo che li crea (es. il server Flask).
+    """
+    global EXTRACT_POOL
+    with EXTRACT_POOL_LOCK:
+        if EXTRACT_POOL is None:
+            EXTRACT_POOL = multiprocessing.get_context('spawn').Pool(os.cpu_count() or 1)
+            atexit.register(close_extract_pool)
+        return EXTRACT_POOL
+
+def close_extract_pool():
+    """Termina il pool condiviso, se è stato creato"""
+    global EXTRACT_POOL
+    with EXTRACT_POOL_LOCK:
+        if EXTRACT_POOL is not None:
+            EXTRACT_POOL.terminate()
+            EXTRACT_POOL.join()
+            EXTRACT_POOL = None
+
+def iter_metadata_records(eml_paths, workers=None, names=None, pool=None):
+    """Produce un record NDJSON per ogni file EML, nell'ordine dei file, usando un pool di processi
+    
+    Con workers=1 (o un solo file) l'estrazione avviene nel processo corrente.
+    pool, se indicato, è un pool già avviato (es. get_extract_pool()) usato al
+    posto di crearne uno per la chiamata; workers indica allora i suoi processi.
+    """
+    eml_paths = list(eml_paths)
+    jobs = list(zip(eml_paths, names or [None] * len(eml_paths)))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    if workers <= 1 or len(jobs) <= 1:
+        yield from map(extract_metadata_job, jobs)
+        return
+    
+    # imap mantiene l'ordine dei file; i chunk riducono l'overhead di IPC
+    chunksize = max(1, min(64, len(jobs) // (workers * 4)))
+    if pool is not None:
+        yield from pool.imap(extract_metadata_job, jobs, chunksize=chunksize)
+        return
+    
+    with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+        yield from pool.imap(extract_metadata_job, jobs, chunksize=chunksize)
+
+def extract_metadata_ndjson(eml_paths, output, workers=None):
+    """Scrive su output un record NDJSON per ogni file EML usando un pool di processi
+    
+    Restituisce il numero di record scritti
+    """
+    count = 0
+    for record in iter_metadata_records(eml_paths, workers):
+        output.write(record + "\n")
+        count += 1
+    return count
 
 def format_file_size(size_bytes):
     """Formatta la dimensione del file in formato leggibile"""
@@ -255,10 +543,192 @@ def format_file_size(size_bytes):
     else:
         return f"{size_bytes:.1f} {size_names[i]}"
 
-def create_pdf_with_attachments(email_data, output_path):
-    """Crea il PDF con il contenuto dell'email e la lista degli allegati"""
+def summarize_attachments(attachments):
+    """Raggruppa gli allegati per content type: lista di (tipo, numero, byte totali)"""
+    groups = {}
+    for attachment in attachments:
+        content_type = attachment.get('content_type') or 'application/octet-stream'
+        count, total = groups.get(content_type, (0, 0))
+        groups[content_type] = (count + 1, total + attachment.get('size_bytes', 0))
+    
+    # Ordina per numero di allegati decrescente, poi per nome del tipo
+    return sorted(
+        ((content_type, count, total) for content_type, (count, total) in groups.items()),
+        key=lambda item: (-item[1], item[0])
+    )
+
+def wrap_filename(filename, max_width, font_name='Helvetica', font_size=9):
+    """Va a capo nei nomi file più larghi di max_width (stringa su più righe)
+    
+    I nomi file spesso non hanno spazi: Paragraph li spezzerebbe misurando un
+    carattere alla volta, mentre qui le larghezze dei caratteri sono in cache.
+    """
+    if stringWidth(filename, font_name, font_size) <= max_width:
+        return filename
+    
+    lines = []
+    line_start = 0
+    line_width = 0
+    for i, char in enumerate(filename):
+        key = (char, font_name, font_size)
+        char_width = CHAR_WIDTHS.get(key)
+        if char_width is None:
+            char_width = CHAR_WIDTHS[key] = stringWidth(char, font_name, font_size)
+        if line_width + char_width > max_width and i > line_start:
+            lines.append(filename[line_start:i])
+            line_start = i
+            line_width = 0
+        line_width += char_width
+    lines.append(filename[line_start:])
+    return '\n'.join(lines)
+
+def build_attachment_section(attachments, styles, max_rows=None):
+    """Crea i flowable della lista allegati, adatti anche a migliaia di righe"""
+    flowables = []
+    
+    # Larghezza utile della colonna Nome file (12cm meno il padding della cella)
+    filename_width = 12*cm - 12
+    
+    base_style = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+        ('TOPPADDING', (0, 1), (-1, -1), 3),
+        ('BOTTOMPADDING', (0, 1), (-1, -1), 3),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]
+    
+    grouped = len(attachments) >= ATTACHMENT_SUMMARY_MIN
+    
+    # Riepilogo per tipo (numero e dimensione totale) per messaggi con molti allegati
+    if grouped:
+        summary = summarize_attachments(attachments)
+        summary_data = [['Tipo', 'Numero', 'Dimensione totale']]
+        for content_type, count, total in summary:
+            summary_data.append([content_type, str(count), format_file_size(total)])
+        summary_data.append([
+            'Totale',
+            str(len(attachments)),
+            format_file_size(sum(total for _, _, total in summary))
+        ])
+        
+        summary_table = LongTable(summary_data, colWidths=[9*cm, 2.5*cm, 3.5*cm], repeatRows=1)
+        summary_table.setStyle(TableStyle(base_style + [
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ]))
+        flowables.append(summary_table)
+        flowables.append(Spacer(1, 0.5*cm))
+        
+        # Raggruppa le righe per tipo mantenendo l'ordine originale all'interno del gruppo
+        order = {content_type: i for i, (content_type, _, _) in enumerate(summary)}
+        attachments = sorted(
+            attachments,
+            key=lambda att: order[att.get('content_type') or 'application/octet-stream']
+        )
+    
+    listed = attachments if max_rows is None else attachments[:max_rows]
+    
+    # Costruisce le righe raggruppate per tipo (un solo gruppo se non raggruppate)
+    groups = []
+    for attachment in listed:
+        content_type = attachment.get('content_type') or 'application/octet-stream'
+        if not groups or (grouped and content_type != groups[-1][0]):
+            groups.append((content_type, []))
+        groups[-1][1].append([wrap_filename(attachment['filename'], filename_width), attachment['size']])
+    
+    # Divide la lista in più tabelle: lo split di una singola tabella enorme
+    # costa sempre di più a ogni pagina. Le tabelle iniziano con un gruppo, così
+    # l'intestazione che compare a metà pagina separa due tipi di allegato; solo
+    # un gruppo più lungo di ATTACHMENT_TABLE_CHUNK viene spezzato al suo interno
+    # e la riga del tipo viene ripetuta con "(continua)".
+    chunks = []
+    rows = []
+    group_rows = []
+    for content_type, group_data in groups:
+        for group_start in range(0, len(group_data), ATTACHMENT_TABLE_CHUNK):
+            part = group_data[group_start:group_start + ATTACHMENT_TABLE_CHUNK]
+            if rows and len(rows) + len(part) > ATTACHMENT_TABLE_CHUNK:
+                chunks.append((rows, group_rows))
+                rows = []
+                group_rows = []
+            if grouped:
+                group_rows.append(len(rows))
+                rows.append([content_type if group_start == 0 else f"{content_type} (continua)", ''])
+            rows.extend(part)
+    if rows:
+        chunks.append((rows, group_rows))
+    
+    for chunk_index, (rows, group_rows) in enumerate(chunks):
+        table_style = list(base_style)
+        for row_index in group_rows:
+            table_row = row_index + 1
+            table_style += [
+                ('SPAN', (0, table_row), (-1, table_row)),
+                ('BACKGROUND', (0, table_row), (-1, table_row), colors.whitesmoke),
+                ('FONTNAME', (0, table_row), (-1, table_row), 'Helvetica-Bold'),
+                # La riga del tipo non resta da sola in fondo alla pagina
+                ('NOSPLIT', (0, table_row), (-1, table_row + 1)),
+            ]
+        
+        # Spazio tra le tabelle: i bordi di due tabelle adiacenti si sovrapporrebbero
+        if chunk_index:
+            flowables.append(Spacer(1, 0.3*cm))
+        attachment_table = LongTable(
+            [['Nome file', 'Dimensione']] + rows,
+            colWidths=[12*cm, 3*cm],
+            repeatRows=1
+        )
+        attachment_table.setStyle(TableStyle(table_style))
+        flowables.append(attachment_table)
+    
+    # Riga di riepilogo per gli allegati non elencati
+    omitted = attachments[len(listed):]
+    if omitted:
+        omitted_size = format_file_size(sum(att.get('size_bytes', 0) for att in omitted))
+        flowables.append(Spacer(1, 0.3*cm))
+        flowables.append(Paragraph(
+            f"<i>... e altri {len(omitted)} allegati non elencati ({omitted_size})</i>",
+            styles['Normal']
+        ))
+    
+    return flowables
+
+def create_pdf_with_attachments(email_data, output_path, max_rows=DEFAULT_MAX_ROWS, progress=None):
+    """Crea il PDF con il contenuto dell'email e la lista degli allegati
+    
+    max_rows limita il numero di allegati elencati (None = tutti, default
+    MAX_ATTACHMENT_ROWS).
+    progress, se indicato, viene chiamato a ogni pagina impaginata come
+    progress('rendering', pages=N, percent=P); un'eccezione sollevata dal
+    callback interrompe la generazione del PDF.
+    """
+    if max_rows is DEFAULT_MAX_ROWS:
+        max_rows = MAX_ATTACHMENT_ROWS
     
     doc = SimpleDocTemplate(output_path, pagesize=A4)
+    
+    if progress:
+        # ReportLab notifica SIZE_EST (numero di flowable), PROGRESS e PAGE
+        build_state = {'total': 0, 'done': 0}
+        
+        def on_build_progress(event, value):
+            if event == 'SIZE_EST':
+                build_state['total'] = value
+            elif event == 'PROGRESS':
+                build_state['done'] = value
+            elif event == 'PAGE':
+                percent = 100 * build_state['done'] // build_state['total'] if build_state['total'] else 0
+                progress('rendering', pages=value, percent=percent)
+        
+        doc.setProgressCallBack(on_build_progress)
+    
     styles = getSampleStyleSheet()
     story = []
     
@@ -305,34 +775,7 @@ def create_pdf_with_attachments(email_data, output_path):
         story.append(Paragraph("<b>— Allegati: —</b>", styles['Heading2']))
         story.append(Spacer(1, 0.3*cm))
         
-        # Crea tabella degli allegati (solo Nome file e Dimensione)
-        attachment_data = [['Nome file', 'Dimensione']]
-        
-        for attachment in email_data['attachments']:
-            attachment_data.append([
-                attachment['filename'], 
-                attachment['size']
-            ])
-        
-        # Crea la tabella con solo 2 colonne
-        attachment_table = Table(attachment_data, colWidths=[12*cm, 3*cm])
-        attachment_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
-            ('TOPPADDING', (0, 1), (-1, -1), 3),
-            ('BOTTOMPADDING', (0, 1), (-1, -1), 3),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        
-        story.append(attachment_table)
+        story.extend(build_attachment_section(email_data['attachments'], styles, max_rows))
         
         # Aggiunge data e info di consegna
         story.append(Spacer(1, 0.5*cm))
@@ -382,19 +825,43 @@ def convert_eml_to_pdf(eml_file_path, output_pdf_path=None):
         import traceback
         traceback.print_exc()
 
+def collect_eml_paths(paths):
+    """Espande le cartelle nei file .eml contenuti (ordinati per nome)"""
+    eml_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith('.eml'):
+                    eml_paths.append(os.path.join(path, name))
+        else:
+            eml_paths.append(path)
+    return eml_paths
+
 if __name__ == "__main__":
-    # Esempio di utilizzo
-    eml_file = "esempio.eml"  # Sostituisci con il percorso del tuo file EML
-    pdf_file = "output.pdf"   # Sostituisci con il percorso di output desiderato
-    
-    convert_eml_to_pdf(eml_file, pdf_file)
-    
-    # Per convertire tutti i file EML in una cartella:
-    """
-    import glob
-    
-    eml_files = glob.glob("*.eml")
-    for eml_file in eml_files:
-        pdf_file = os.path.splitext(eml_file)[0] + ".pdf"
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Converte file EML in PDF o ne estrae i metadati")
+    parser.add_argument('paths', nargs='*', help="file .eml o cartelle che li contengono")
+    parser.add_argument('--extract-only', action='store_true',
+                        help="estrae solo header e allegati come NDJSON, senza generare PDF")
+    parser.add_argument('-o', '--output', help="file NDJSON di output (default: stdout)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="numero di processi per --extract-only (default: numero di CPU)")
+    args = parser.parse_args()
+    
+    if args.extract_only:
+        eml_paths = collect_eml_paths(args.paths)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as out:
+                extract_metadata_ndjson(eml_paths, out, args.workers)
+        else:
+            extract_metadata_ndjson(eml_paths, sys.stdout, args.workers)
+    elif args.paths:
+        for eml_file in collect_eml_paths(args.paths):
+            convert_eml_to_pdf(eml_file)
+    else:
+        # Esempio di utilizzo
+        eml_file = "esempio.eml"  # Sostituisci con il percorso del tuo file EML
+        pdf_file = "output.pdf"   # Sostituisci con il percorso di output desiderato
+        
         convert_eml_to_pdf(eml_file, pdf_file)
-    """
\ No newline at end of file